@@ -3,10 +3,12 @@
 # requires-python = ">=3.8"
 # dependencies = [
 #   "pysrt",
-#   "openai",
+#   "openai>=1.0",
 #   "tqdm",
 #   "loguru",
 #   "ffmpeg-python",
+#   "tiktoken",
+#   "httpx[http2]",
 # ]
 # ///
 """
@@ -14,20 +16,107 @@ SRT AI Translator - Translate SRT subtitle files using OpenAI API
 """
 
 import argparse
+import asyncio
+import contextlib
+import copy
+import datetime
+import functools
+import hashlib
+import io
+import itertools
+import math
+import os
+import random
+import sqlite3
+import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from xml.sax.saxutils import escape, unescape
+import httpx
 import pysrt
-from openai import OpenAI, APIConnectionError, AuthenticationError, APIStatusError
-from tqdm import tqdm
-import xml.etree.ElementTree as ET
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    APIError,
+    APITimeoutError,
+    AuthenticationError,
+    APIStatusError,
+    BadRequestError,
+    ConflictError,
+    InternalServerError,
+    NotFoundError,
+    PermissionDeniedError,
+    RateLimitError,
+    UnprocessableEntityError,
+)
+from tqdm.asyncio import tqdm
+import tiktoken
 import re
 from loguru import logger
 import ffmpeg
 import json
 import tempfile
 
+# aiohttp is only needed for --fast-transport aiohttp
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# h2 lets httpx use HTTP/2, which multiplexes concurrent requests over
+# fewer connections
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# lxml parses the answers faster, the standard library parser is the fallback
+try:
+    from lxml import etree
+
+    # Parser for answers that are too broken for the regex fallback
+    _RECOVERING_PARSER = etree.XMLParser(recover=True)
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+    _RECOVERING_PARSER = None
+
 VERSION: str = "0.2.1"
 
+# Pattern used to parse malformed answers, compiled once
+_TEXT_RE = re.compile(r'<text id="(\d+)">(.*?)</text>', re.DOTALL)
+
+# Entities unescaped in the answers on top of &amp; &lt; &gt;
+_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+# Patterns used to find the cues that have words to translate
+_TAG_RE = re.compile(r"<[^>]*>")
+_LETTER_RE = re.compile(r"[A-Za-z\u00C0-\u024F\u0370-\u1FFF\u3040-\uFFEF]")
+# Kana, CJK ideographs and Hangul, where a single character can be a word
+_CJK_RE = re.compile(r"[\u3040-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]")
+# Sound cues such as [Music] or [Applause], possibly on several lines
+_SOUND_CUE_RE = re.compile(r"^(\s*\[[^\]]*\]\s*)+$")
+
+# Instructions sent as the system message, identical for every request
+_SYSTEM_PROMPT_TEMPLATE = """Please translate the subtitle texts given by the user to %s. Think about the context and provide accurate translations.
+
+The timing information (start/end) is provided to help you understand the temporal context - whether this is rapid dialogue or if significant time has passed between subtitles.
+
+The user message contains the context of the subtitles in an <srt-context> tag, followed by the subtitle texts to translate. Special characters in the texts are escaped as XML entities (&amp; &lt; &gt;), keep them escaped in your answer.
+
+Please think about the translation, then provide your answer in this exact format:
+<answer>
+<text id="1">translated text here</text>
+<text id="2">translated text here</text>
+...
+</answer>"""
+
+# Template of one subtitle entry in the prompt
+_TEXT_TEMPLATE = '<text id="%d" start="%s" end="%s">%s</text>'
+
 
 def main():
     # Configure logger to write to ./logs.txt with rotation and retention
@@ -63,9 +152,104 @@ def main():
         help="Number of subtitle entries to process in each batch (default: 4)",
     )
     parser.add_argument(
-        "--model", required=True, help="Model name to use for translation"
+        "--windows-per-request",
+        type=int,
+        default=None,
+        help="Number of windows merged into a single API request to amortize the prompt overhead (default: 4, or no limit when --max-chars-per-request or --max-output-tokens is set)",
+    )
+    parser.add_argument(
+        "--max-chars-per-request",
+        type=int,
+        default=None,
+        help="Merge windows into a request until their subtitle texts reach this many characters (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-output-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of tokens of each answer, sent as max_tokens. Also limits the characters merged into a request so that answers fit (default: no limit)",
+    )
+    parser.add_argument(
+        "--chars-per-token",
+        type=float,
+        default=3.5,
+        help="Average number of characters per token of the subtitles, used with --max-output-tokens (default: 3.5)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of windows translated concurrently (default: 8)",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=None,
+        help="Size of the HTTP connection pool (default: twice --max-concurrency)",
+    )
+    parser.add_argument(
+        "--max-rpm",
+        type=float,
+        default=None,
+        help="Maximum number of requests per minute sent to the API (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-tpm",
+        type=float,
+        default=None,
+        help="Maximum number of tokens per minute sent to the API (default: no limit)",
+    )
+    parser.add_argument(
+        "--batch-api",
+        "--batch",
+        action="store_true",
+        help="Submit all windows through the OpenAI Batch API: half the cost and separate rate limits, but results can take up to 24h",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the answers and stop reading each one as soon as its </answer> tag arrives (requires an API supporting streaming)",
+    )
+    parser.add_argument(
+        "--cache-path",
+        default=str(
+            Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+            / "srt_ai_translator"
+            / "translations.sqlite3"
+        ),
+        help="Path of the SQLite cache of translations, reused across runs (default: srt_ai_translator/translations.sqlite3 in the user cache directory)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the on-disk translation cache, repeated lines are still translated once per run",
+    )
+    parser.add_argument(
+        "--fast-transport",
+        choices=["aiohttp"],
+        default=None,
+        help="Bypass the OpenAI SDK and POST to /chat/completions directly with the given HTTP library (requires aiohttp to be installed)",
+    )
+    parser.add_argument(
+        "--model",
+        required=True,
+        help="Model name to use for translation (with --backend local: path of the CTranslate2 model directory)",
+    )
+    parser.add_argument(
+        "--base-url",
+        help="Base URL for the OpenAI API (required unless --backend local)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["openai", "local"],
+        default="openai",
+        help="Translate with an OpenAI compatible API, or locally with an NLLB-200 model converted for CTranslate2, which requires ctranslate2 and transformers (default: openai)",
+    )
+    parser.add_argument(
+        "--source-language",
+        help="Language code of the subtitles in the local model's convention, e.g. eng_Latn for NLLB-200. Required by --backend local, which also expects such a code as --target-language",
     )
-    parser.add_argument("--base-url", required=True, help="Base URL for the OpenAI API")
     parser.add_argument(
         "--api-key",
         help="API key for OpenAI (if not provided, uses OPENAI_API_KEY environment variable)",
@@ -73,6 +257,63 @@ def main():
 
     args = parser.parse_args()
 
+    if args.windows_per_request is not None and args.windows_per_request < 1:
+        logger.error(
+            f"--windows-per-request must be at least 1, got: {args.windows_per_request}"
+        )
+        sys.exit(1)
+    if args.max_chars_per_request is not None and args.max_chars_per_request < 1:
+        logger.error(
+            f"--max-chars-per-request must be at least 1, got: {args.max_chars_per_request}"
+        )
+        sys.exit(1)
+    if args.max_output_tokens is not None and args.max_output_tokens < 1:
+        logger.error(
+            f"--max-output-tokens must be at least 1, got: {args.max_output_tokens}"
+        )
+        sys.exit(1)
+    if args.chars_per_token <= 0:
+        logger.error(f"--chars-per-token must be positive, got: {args.chars_per_token}")
+        sys.exit(1)
+    if args.max_output_tokens:
+        # The answer is about as long as the texts sent, keep 40% of the
+        # output budget for the model's thinking and the XML tags
+        output_chars = max(1, int(args.max_output_tokens * args.chars_per_token * 0.6))
+        if not args.max_chars_per_request or output_chars < args.max_chars_per_request:
+            args.max_chars_per_request = output_chars
+    if args.windows_per_request is None and not args.max_chars_per_request:
+        # Without a character budget, a fixed number of windows keeps the
+        # requests small enough. With one, the budget alone decides how many
+        # windows go in a request so that long-context models are used fully
+        args.windows_per_request = 4
+    if args.max_concurrency < 1:
+        logger.error(
+            f"--max-concurrency must be at least 1, got: {args.max_concurrency}"
+        )
+        sys.exit(1)
+    if args.max_connections is not None and args.max_connections < 1:
+        logger.error(
+            f"--max-connections must be at least 1, got: {args.max_connections}"
+        )
+        sys.exit(1)
+    for flag, value in (("--max-rpm", args.max_rpm), ("--max-tpm", args.max_tpm)):
+        if value is not None and value <= 0:
+            logger.error(f"{flag} must be positive, got: {value}")
+            sys.exit(1)
+
+    if args.fast_transport == "aiohttp" and aiohttp is None:
+        logger.error(
+            "--fast-transport aiohttp requires aiohttp, install it with: pip install aiohttp"
+        )
+        sys.exit(1)
+
+    if args.batch_api and args.fast_transport:
+        logger.error("--batch-api cannot be used with --fast-transport")
+        sys.exit(1)
+    if args.batch_api and args.stream:
+        logger.error("--batch-api cannot be used with --stream")
+        sys.exit(1)
+
     # Validate that either --srt-file or --video is provided (but not both)
     if not args.srt_file and not args.video:
         logger.error("Either --srt-file or --video must be provided")
@@ -81,8 +322,19 @@ def main():
         logger.error("Cannot specify both --srt-file and --video")
         sys.exit(1)
 
+    if args.backend == "local":
+        if not args.source_language:
+            logger.error("--backend local requires --source-language")
+            sys.exit(1)
+        if args.batch_api:
+            logger.error("--batch-api cannot be used with --backend local")
+            sys.exit(1)
+    elif not args.base_url:
+        logger.error("--base-url is required unless --backend local is used")
+        sys.exit(1)
+
     # Validate base URL starts with http:// or https://
-    if not (
+    if args.base_url and not (
         args.base_url.startswith("http://") or args.base_url.startswith("https://")
     ):
         logger.error(
@@ -90,16 +342,8 @@ def main():
         )
         sys.exit(1)
 
-    # Crash if output file already exists to prevent accidental overwrites
-    # This check must happen after default output path generation
-    if Path(args.output_path).exists():
-        logger.error(
-            f"Output file '{args.output_path}' already exists. Please remove it first or choose a different output path."
-        )
-        sys.exit(1)
-
-    # Handle video input - extract subtitles to temporary SRT file
-    temp_srt_file = None
+    # Handle video input - subtitles are streamed from ffmpeg's output
+    selected_stream = None
     if args.video:
         if not Path(args.video).exists():
             logger.error(f"Video file '{args.video}' not found")
@@ -113,7 +357,6 @@ def main():
             sys.exit(1)
 
         # If multiple streams, prompt user for choice
-        selected_stream = None
         if len(subtitle_streams) == 1:
             selected_stream = subtitle_streams[0]
             logger.info(
@@ -121,16 +364,27 @@ def main():
             )
         else:
             logger.info(f"Found {len(subtitle_streams)} subtitle streams:")
-            for idx, stream in enumerate(subtitle_streams):
+
+            # Get preview texts to help identify the streams
+            # Each preview is its own ffmpeg process, so they can run side by side
+            with ThreadPoolExecutor(
+                max_workers=min(8, len(subtitle_streams))
+            ) as executor:
+                previews = list(
+                    executor.map(
+                        lambda stream: get_subtitle_preview(
+                            video_path=args.video, stream_index=stream["index"]
+                        ),
+                        subtitle_streams,
+                    )
+                )
+
+            for idx, (stream, preview) in enumerate(zip(subtitle_streams, previews)):
                 lang = stream.get("language", "unknown")
                 codec = stream.get("codec_name", "unknown")
                 title = stream.get("title", "")
                 title_str = f" - {title}" if title else ""
 
-                # Get preview text to help identify the stream
-                preview = get_subtitle_preview(
-                    video_path=args.video, stream_index=stream["index"]
-                )
                 preview_str = f" | Preview: {preview}" if preview else ""
 
                 logger.info(f"  {idx + 1}. {lang} ({codec}){title_str}{preview_str}")
@@ -152,102 +406,191 @@ def main():
                     logger.error("Invalid input or interrupted")
                     sys.exit(1)
 
-        # Extract subtitle to temporary SRT file
-        # Using NamedTemporaryFile with delete=False to keep the file for processing
-        # We'll clean it up at the end
-        temp_srt_file = tempfile.NamedTemporaryFile(
-            mode="w", suffix=".srt", delete=False
-        )
-        temp_srt_path = temp_srt_file.name
-        temp_srt_file.close()
-
-        try:
-            extract_subtitle_stream(
-                video_path=args.video,
-                stream_index=selected_stream["index"],
-                output_path=temp_srt_path,
-            )
-            logger.info(f"Extracted subtitle to temporary file: {temp_srt_path}")
-            args.srt_file = temp_srt_path
-
-            # Generate default output path if not provided
-            # Uses video filename, stream language, and target language for clarity
-            if not args.output_path:
-                video_stem = Path(args.video).stem
-                stream_lang = selected_stream.get("language", "unknown")
-                args.output_path = (
-                    f"{video_stem}_{stream_lang}_{args.target_language}.srt"
-                )
-                logger.info(f"Auto-generated output path: {args.output_path}")
-        except Exception as e:
-            logger.error(f"Failed to extract subtitle: {e}")
-            Path(temp_srt_path).unlink(missing_ok=True)
+        # Generate default output path if not provided
+        # Uses video filename, stream language, and target language for clarity
+        if not args.output_path:
+            video_stem = Path(args.video).stem
+            stream_lang = selected_stream.get("language", "unknown")
+            args.output_path = f"{video_stem}_{stream_lang}_{args.target_language}.srt"
+            logger.info(f"Auto-generated output path: {args.output_path}")
+
+    else:
+        # Generate default output path for SRT input if not provided
+        # Uses SRT filename and target language
+        if not args.output_path:
+            srt_stem = Path(args.srt_file).stem
+            args.output_path = f"{srt_stem}_{args.target_language}.srt"
+            logger.info(f"Auto-generated output path: {args.output_path}")
+
+        # Validate input file exists
+        if not Path(args.srt_file).exists():
+            logger.error(f"SRT file '{args.srt_file}' not found")
             sys.exit(1)
 
-    # Generate default output path for SRT input if not provided
-    # Uses SRT filename and target language
-    if not args.output_path:
-        srt_stem = Path(args.srt_file).stem
-        args.output_path = f"{srt_stem}_{args.target_language}.srt"
-        logger.info(f"Auto-generated output path: {args.output_path}")
-
-    # Validate input file exists
-    if not Path(args.srt_file).exists():
-        logger.error(f"SRT file '{args.srt_file}' not found")
+    # Crash if output file already exists to prevent accidental overwrites
+    # This check must happen after default output path generation
+    if Path(args.output_path).exists():
+        logger.error(
+            f"Output file '{args.output_path}' already exists. Please remove it first or choose a different output path."
+        )
         sys.exit(1)
 
-    logger.info(f"Processing: {args.srt_file}")
+    if args.video:
+        logger.info(
+            f"Processing: {args.video} (subtitle stream {selected_stream['index']})"
+        )
+    else:
+        logger.info(f"Processing: {args.srt_file}")
     logger.info(f"Window size: {args.window_size}")
+    if args.windows_per_request:
+        logger.info(f"Windows per request: {args.windows_per_request}")
+    if args.max_chars_per_request:
+        logger.info(f"Max characters per request: {args.max_chars_per_request}")
+    if args.max_output_tokens:
+        logger.info(f"Max output tokens: {args.max_output_tokens}")
+    logger.info(f"Max concurrency: {args.max_concurrency}")
+    if args.batch_api:
+        logger.info("Using the Batch API")
+    if args.fast_transport:
+        logger.info(f"Fast transport: {args.fast_transport}")
+    if args.max_rpm:
+        logger.info(f"Max requests per minute: {args.max_rpm}")
+    if args.max_tpm:
+        logger.info(f"Max tokens per minute: {args.max_tpm}")
     logger.info(f"Model: {args.model}")
+    if args.backend == "local":
+        logger.info(
+            f"Backend: local ({args.source_language} -> {args.target_language})"
+        )
     logger.info(f"Output: {args.output_path}")
     logger.info(f"Target language: {args.target_language}")
+    logger.info(f"Cache: {'in memory' if args.no_cache else args.cache_path}")
     if args.srt_context:
         logger.info(f"Context: {args.srt_context}")
 
-    # Parse SRT file
-    try:
-        subs = pysrt.open(path=args.srt_file)
-        logger.info(f"Loaded {len(subs)} subtitle entries")
-    except Exception as e:
-        logger.error(f"Error parsing SRT file: {e}")
-        sys.exit(1)
+    # Only count the subtitle entries here to size the progress bar, the
+    # file is parsed lazily while the first windows are already translating
+    # Subtitles streamed from a video cannot be counted without reading the
+    # whole video twice, so the progress bar has no total in that case
+    n_windows = None
+    if args.srt_file:
+        try:
+            n_subs = count_subtitles(path=args.srt_file)
+            logger.info(f"Found {n_subs} subtitle entries")
+        except Exception as e:
+            logger.error(f"Error reading SRT file: {e}")
+            sys.exit(1)
+        n_windows = math.ceil(n_subs / args.window_size)
+        logger.info(f"Processing {n_windows} windows...")
 
-    # Initialize OpenAI client
-    # If api_key is not provided, OpenAI client will use OPENAI_API_KEY environment variable
-    client = OpenAI(base_url=args.base_url, api_key=args.api_key)
+    # Loading a local model takes a while and can fail, do it before
+    # creating any file
+    translator = None
+    if args.backend == "local":
+        try:
+            translator = LocalTranslator(
+                model_path=args.model,
+                source_language=args.source_language,
+                target_language=args.target_language,
+            )
+        except ImportError as e:
+            logger.error(
+                f"--backend local requires ctranslate2 and transformers, install them with: pip install ctranslate2 transformers sentencepiece ({e})"
+            )
+            sys.exit(1)
+        except Exception as e:
+            logger.error(f"Error loading local model '{args.model}': {e}")
+            sys.exit(1)
 
-    # Process subtitles in windows
-    translated_subs = pysrt.SubRipFile()
     tmp_output_path = Path(args.output_path).with_suffix(
         Path(args.output_path).suffix + ".tmp"
     )
 
-    # Create windows of subtitles
-    windows = []
-    for i in range(0, len(subs), args.window_size):
-        window = subs[i : i + args.window_size]
-        windows.append(window)
-
-    logger.info(f"Processing {len(windows)} windows...")
+    # Translated windows are appended to a temporary file as soon as they
+    # are done, which allows recovery on failure, and the final output only
+    # appears once it is complete
+    try:
+        writer = OrderedSrtWriter(path=tmp_output_path)
+    except Exception as e:
+        logger.error(f"Error opening temporary file: {e}")
+        sys.exit(1)
 
-    # Process each window with progress bar
-    for window_idx, window in enumerate(tqdm(iterable=windows, desc="Translating")):
-        translated_window = translate_window(
-            client=client,
-            window=window,
-            model=args.model,
-            context=args.srt_context,
-            target_language=args.target_language,
-        )
-        translated_subs.extend(translated_window)
+    # Subtitles translated before, in this run or a previous one, are
+    # looked up instead of being sent to the API again. Without the on-disk
+    # cache, an in-memory one still translates repeated lines once per run
+    cache_path = ":memory:" if args.no_cache else args.cache_path
+    try:
+        cache = TranslationCache(path=cache_path)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error opening translation cache '{cache_path}': {e}")
+        sys.exit(1)
 
-        # Write current progress to temporary file after each window
-        # This allows continuous incremental updates and recovery on failure
+    async def run():
+        # If api_key is not provided, OpenAI client will use OPENAI_API_KEY environment variable
+        client = None
+        if translator is None:
+            client = get_client(
+                base_url=args.base_url,
+                api_key=args.api_key,
+                max_concurrency=args.max_concurrency,
+                fast_transport=args.fast_transport,
+                max_connections=args.max_connections,
+            )
         try:
-            translated_subs.save(path=str(tmp_output_path), encoding="utf-8")
-        except Exception as e:
-            logger.error(f"Error saving progress to temporary file: {e}")
-            sys.exit(1)
+            if args.video:
+                subs = stream_video_subtitles(
+                    video_path=args.video, stream_index=selected_stream["index"]
+                )
+            else:
+                subs = stream_srt_file(path=args.srt_file)
+            # Closing the generator stops ffmpeg if the translation fails
+            with contextlib.closing(subs):
+                windows = iter_windows(subs=subs, window_size=args.window_size)
+                if translator is not None:
+                    return await translate_windows_local(
+                        translator=translator,
+                        windows=windows,
+                        writer=writer,
+                        total_windows=n_windows,
+                        cache=cache,
+                    )
+                if args.batch_api:
+                    return await translate_windows_batch(
+                        client=client,
+                        windows=windows,
+                        writer=writer,
+                        model=args.model,
+                        context=args.srt_context,
+                        target_language=args.target_language,
+                        cache=cache,
+                        max_tokens=args.max_output_tokens,
+                    )
+                # Translate all windows concurrently, the writer puts them back in order
+                return await translate_windows(
+                    client=client,
+                    windows=windows,
+                    writer=writer,
+                    total_windows=n_windows,
+                    windows_per_request=args.windows_per_request,
+                    max_chars_per_request=args.max_chars_per_request,
+                    cache=cache,
+                    stream=args.stream,
+                    max_tokens=args.max_output_tokens,
+                    model=args.model,
+                    context=args.srt_context,
+                    target_language=args.target_language,
+                    max_concurrency=args.max_concurrency,
+                    max_rpm=args.max_rpm,
+                    max_tpm=args.max_tpm,
+                )
+        finally:
+            await close_clients()
+
+    try:
+        asyncio.run(run())
+    finally:
+        writer.close()
+        cache.close()
 
     # Atomically rename temp file to final output
     # This ensures the final output is written atomically
@@ -257,202 +600,2041 @@ def main():
     except Exception as e:
         logger.error(f"Error finalizing output file: {e}")
         sys.exit(1)
-    finally:
-        # Clean up temporary SRT file if it was created from video extraction
-        if temp_srt_file:
-            Path(temp_srt_path).unlink(missing_ok=True)
-            logger.info("Cleaned up temporary subtitle file")
 
 
-def translate_window(client, window, model, context, target_language):
-    """Translate a window of subtitle entries using OpenAI API
+# Status codes mapped to the OpenAI SDK exception raised for them, so that
+# AiohttpChatClient errors go through the same handling as the SDK ones
+_STATUS_ERRORS = {
+    400: BadRequestError,
+    401: AuthenticationError,
+    403: PermissionDeniedError,
+    404: NotFoundError,
+    409: ConflictError,
+    422: UnprocessableEntityError,
+    429: RateLimitError,
+}
 
-    Parameters
-    ----------
-    client : OpenAI
-        OpenAI client instance
-    window : list
-        List of subtitle entries to translate
-    model : str
-        Model name to use for translation
-    context : str
-        Context information for translation
-    target_language : str
-        Target language for translation
-    """
-    # Build XML prompt with timing information
-    # Including timing helps the LLM understand temporal context (e.g., rapid dialogue vs. long pauses)
-    xml_texts = []
-    for i, sub in enumerate(window, start=1):
-        xml_texts.append(
-            f'<text id="{i}" start="{sub.start}" end="{sub.end}">{sub.text}</text>'
-        )
 
-    context_xml = (
-        f"<srt-context>{context}</srt-context>"
-        if context
-        else "<srt-context></srt-context>"
-    )
+class AiohttpChatClient:
+    """Minimal chat completions client POSTing directly with aiohttp
 
-    prompt = f"""Please translate the following subtitle texts to {target_language}. Think about the context and provide accurate translations.
+    The OpenAI SDK's httpx client adds noticeable per-request overhead under
+    many concurrent requests. As only the chat completions endpoint is used,
+    this client sends the JSON payload itself and raises the same exceptions
+    as the SDK on errors.
 
-The timing information (start/end) is provided to help you understand the temporal context - whether this is rapid dialogue or if significant time has passed between subtitles.
+    Parameters
+    ----------
+    base_url : str
+        Base URL for the OpenAI API
+    api_key : str or None
+        API key, None to use the OPENAI_API_KEY environment variable
+    max_connections : int
+        Maximum number of connections opened by the client
+    """
 
-{context_xml}
+    def __init__(self, base_url: str, api_key, max_connections: int):
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        api_key = api_key or os.environ.get("OPENAI_API_KEY", "")
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections, ttl_dns_cache=300),
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=aiohttp.ClientTimeout(total=600.0, connect=10.0),
+        )
 
-{chr(10).join(xml_texts)}
+    async def create_chat_completion(self, **payload) -> str:
+        """POST a chat completion request and return the answer content
 
-Please think about the translation, then provide your answer in this exact format:
-<answer>
-<text id="1">translated text here</text>
-<text id="2">translated text here</text>
-...
-</answer>"""
+        Parameters
+        ----------
+        **payload
+            JSON body of the request (model, messages, temperature...)
 
-    max_retries = 3
-    for attempt in range(max_retries):
+        Returns
+        -------
+        str
+            Content of the first choice's message
+        """
+        request = httpx.Request(method="POST", url=self.url)
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-            )
+            async with self.session.post(self.url, json=payload) as resp:
+                if payload.get("stream") and resp.status < 400:
+                    return await read_streamed_answer(
+                        deltas=self.iter_stream_deltas(resp=resp)
+                    )
+                text = await resp.text()
+                try:
+                    body = json.loads(text)
+                except json.JSONDecodeError:
+                    # Proxies and gateways may answer errors in plain text
+                    body = text
+                if resp.status >= 400:
+                    error_class = _STATUS_ERRORS.get(
+                        resp.status,
+                        InternalServerError if resp.status >= 500 else APIStatusError,
+                    )
+                    response = httpx.Response(
+                        status_code=resp.status,
+                        headers=dict(resp.headers),
+                        request=request,
+                    )
+                    message = f"Error code: {resp.status} - {body}"
+                    raise error_class(message, response=response, body=body)
+        except asyncio.TimeoutError:
+            raise APITimeoutError(request=request)
+        except aiohttp.ClientError as e:
+            raise APIConnectionError(message=str(e), request=request)
+        return get_answer_content(response=body)
+
+    @staticmethod
+    async def iter_stream_deltas(resp):
+        """Yield the content deltas of a streamed chat completion response
+
+        Parameters
+        ----------
+        resp : aiohttp.ClientResponse
+            Response whose body is a stream of server-sent events
+
+        Yields
+        ------
+        str
+            Content of each chunk's first choice
+        """
+        async for line in resp.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:") :].strip()
+            if data == b"[DONE]":
+                return
+            chunk = json.loads(data)
+            if chunk.get("choices"):
+                yield chunk["choices"][0].get("delta", {}).get("content")
 
-            response_text = response.choices[0].message.content
-            translated_texts = parse_xml_response(response_text, len(window))
+    async def close(self):
+        """Close the underlying aiohttp session"""
+        await self.session.close()
 
-            # Create translated subtitle entries
-            translated_window = []
-            for i, (original_sub, translated_text) in enumerate(
-                zip(window, translated_texts)
-            ):
-                new_sub = pysrt.SubRipItem(
-                    index=original_sub.index,
-                    start=original_sub.start,
-                    end=original_sub.end,
-                    text=translated_text,
-                )
-                translated_window.append(new_sub)
 
-            return translated_window
+async def create_chat_completion(client, **payload) -> str:
+    """Send a chat completion request through either supported client
 
-        except APIConnectionError as e:
-            # Connection errors should crash immediately with helpful trace
-            logger.error(f"API connection error - check network and base URL: {e}")
-            raise
-        except AuthenticationError as e:
-            # Authentication errors should crash immediately
-            logger.error(f"API authentication failed - check API key: {e}")
-            raise
-        except APIStatusError as e:
-            # API status errors (like invalid model) should crash immediately
-            logger.error(f"API returned error status - check model name and API: {e}")
-            raise
-        except Exception as e:
-            if attempt < max_retries - 1:
-                # Retry with error message for parsing errors
-                prompt += f"\n\nPrevious parsing failed with error: {str(e)}. Please correct the format and try again."
-                continue
-            else:
-                logger.error(
-                    f"Failed to translate window after {max_retries} attempts: {e}"
+    Parameters
+    ----------
+    client : AsyncOpenAI or AiohttpChatClient
+        Client returned by get_client
+    **payload
+        Arguments of the request (model, messages, temperature...)
+
+    Returns
+    -------
+    str
+        Content of the first choice's message
+    """
+    if isinstance(client, AiohttpChatClient):
+        return await client.create_chat_completion(**payload)
+    response = await client.chat.completions.create(**payload)
+    if payload.get("stream"):
+        try:
+            return await read_streamed_answer(
+                deltas=(
+                    chunk.choices[0].delta.content
+                    async for chunk in response
+                    if chunk.choices
                 )
-                # Return original texts as fallback
-                return window
+            )
+        finally:
+            await response.close()
+    return get_answer_content(response=response)
 
 
-def list_subtitle_streams(video_path: str) -> list:
-    """List all subtitle streams in the video file
+def get_answer_content(response) -> str:
+    """Read the answer of a chat completion response
 
     Parameters
     ----------
-    video_path : str
-        Path to the video file
+    response : ChatCompletion, dict or str
+        Response of the SDK, or decoded JSON body (str if it was not JSON)
+        of the aiohttp client or of a batch output line
 
     Returns
     -------
-    list
-        List of subtitle stream information dictionaries
+    str
+        Content of the first choice's message
+
+    Raises
+    ------
+    ValueError
+        If the response has no answer (e.g. an empty "choices" list), so
+        that it is retried like a malformed answer instead of stopping the
+        run
     """
     try:
-        probe = ffmpeg.probe(filename=video_path)
-        subtitle_streams = [
-            stream for stream in probe["streams"] if stream["codec_type"] == "subtitle"
-        ]
-        return subtitle_streams
-    except ffmpeg.Error as e:
-        logger.error(f"ffmpeg error while probing video: {e.stderr.decode()}")
-        raise
-    except Exception as e:
-        logger.error(f"Error probing video file: {e}")
-        raise
+        if isinstance(response, dict):
+            content = response["choices"][0]["message"]["content"]
+        else:
+            content = response.choices[0].message.content
+    except (IndexError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(
+            f"Unexpected chat completion response: {str(response)[:200]}"
+        ) from e
+    if content is None:
+        raise ValueError("The chat completion response has no content")
+    return content
 
 
-def get_subtitle_preview(video_path: str, stream_index: int) -> str:
-    """Get a preview text from a subtitle stream
+async def read_streamed_answer(deltas) -> str:
+    """Assemble a streamed answer, stopping as soon as </answer> arrives
 
-    Extracts the first text that appears after the 5th text containing at least 10 characters.
-    This helps identify subtitle streams when metadata is unclear.
+    Anything after the answer block is ignored when parsing, so there is no
+    need to wait for the rest of the stream.
 
     Parameters
     ----------
-    video_path : str
-        Path to the video file
-    stream_index : int
-        Index of the subtitle stream
+    deltas : async iterable
+        Content of the successive chunks, None for chunks without content
 
     Returns
     -------
     str
-        Preview text, or empty string if extraction fails or not enough content
+        Answer received so far
     """
-    temp_preview_file = None
-    try:
-        # Create temp file for preview extraction
-        temp_preview_file = tempfile.NamedTemporaryFile(
-            mode="w", suffix=".srt", delete=False
-        )
-        temp_preview_path = temp_preview_file.name
-        temp_preview_file.close()
+    parts = []
+    # End of the previous chunks, in case </answer> is split across chunks
+    tail = ""
+    async for delta in deltas:
+        if not delta:
+            continue
+        parts.append(delta)
+        recent = tail + delta
+        if "</answer>" in recent:
+            break
+        tail = recent[-(len("</answer>") - 1) :]
+    return "".join(parts)
+
+
+# Clients keyed by (base_url, api_key, fast_transport), see get_client
+_CLIENTS = {}
+
+
+def get_client(
+    base_url: str,
+    api_key,
+    max_concurrency: int,
+    fast_transport=None,
+    max_connections=None,
+):
+    """Get the client for an endpoint, creating it once
+
+    The AsyncOpenAI client is backed by an httpx connection pool sized for
+    the target concurrency, so that concurrent requests reuse kept-alive
+    connections instead of waiting for the pool or redoing TCP/TLS
+    handshakes. HTTP/2 is used with HTTPS servers supporting it when h2 is
+    installed.
+
+    Parameters
+    ----------
+    base_url : str
+        Base URL for the OpenAI API
+    api_key : str or None
+        API key, None to use the OPENAI_API_KEY environment variable
+    max_concurrency : int
+        Maximum number of concurrent requests sent through the client
+    fast_transport : str or None
+        "aiohttp" to bypass the OpenAI SDK, None to use it
+    max_connections : int or None
+        Size of the connection pool, None for twice max_concurrency
 
-        # Extract subtitle stream
-        extract_subtitle_stream(
-            video_path=video_path,
-            stream_index=stream_index,
-            output_path=temp_preview_path,
+    Returns
+    -------
+    AsyncOpenAI or AiohttpChatClient
+        Client shared by every call with the same arguments
+    """
+    key = (base_url, api_key, fast_transport)
+    if key in _CLIENTS:
+        return _CLIENTS[key]
+
+    max_connections = max_connections or max_concurrency * 2
+    if fast_transport == "aiohttp":
+        _CLIENTS[key] = AiohttpChatClient(
+            base_url=base_url, api_key=api_key, max_connections=max_connections
         )
+    else:
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30.0,
+        )
+        # Same 10 minutes read timeout as the OpenAI client default, as
+        # reasoning models can take a long time to answer
+        http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(600.0, connect=10.0),
+            http2=h2 is not None,
+        )
+        # Retries are handled by call_with_backoff, which backs off and
+        # notifies the rate limiter, so the SDK must not retry on its own
+        _CLIENTS[key] = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=http_client,
+            max_retries=0,
+        )
+    return _CLIENTS[key]
 
-        # Parse and find the target text
-        subs = pysrt.open(path=temp_preview_path)
 
-        # Find the 5th text with at least 10 characters
-        # Track all seen texts to ensure preview is unique
+async def close_clients():
+    """Close every client created by get_client along with its connection pool"""
+    for client in _CLIENTS.values():
+        await client.close()
+    _CLIENTS.clear()
+
+
+class RateLimiter:
+    """Proactively throttle API requests to stay under rate limits
+
+    Modeled after the OpenAI cookbook's api_request_parallel_processor.py:
+    two capacity buckets (requests and tokens) are refilled continuously
+    according to the configured per-minute caps, and each request waits
+    until both buckets can cover it. After a rate limit error, all requests
+    pause for a cooldown period and the available capacities are halved.
+
+    Parameters
+    ----------
+    max_rpm : float or None
+        Maximum number of requests per minute, None for no limit
+    max_tpm : float or None
+        Maximum number of tokens per minute, None for no limit
+    cooldown : float
+        Seconds to pause all requests after a rate limit error
+    """
+
+    def __init__(self, max_rpm=None, max_tpm=None, cooldown: float = 15.0):
+        self.max_rpm = max_rpm
+        self.max_tpm = max_tpm
+        self.cooldown = cooldown
+        self.available_request_capacity = max_rpm or 0.0
+        self.available_token_capacity = max_tpm or 0.0
+        self.last_update_time = time.monotonic()
+        self.time_of_last_rate_limit_error = None
+        # The lock makes waiting requests acquire capacity one at a time,
+        # in the order they asked for it
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Refill both buckets according to the time elapsed since last refill"""
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        if self.max_rpm:
+            self.available_request_capacity = min(
+                self.max_rpm,
+                self.available_request_capacity + elapsed * self.max_rpm / 60.0,
+            )
+        if self.max_tpm:
+            self.available_token_capacity = min(
+                self.max_tpm,
+                self.available_token_capacity + elapsed * self.max_tpm / 60.0,
+            )
+
+    async def acquire(self, tokens: int):
+        """Wait until a request consuming the given number of tokens can be sent
+
+        Parameters
+        ----------
+        tokens : int
+            Estimated number of tokens consumed by the request
+        """
+        # A single request larger than the whole budget would wait forever
+        if self.max_tpm:
+            tokens = min(tokens, self.max_tpm)
+
+        async with self._lock:
+            while True:
+                # Pause after a rate limit error to let the API cool down
+                if self.time_of_last_rate_limit_error is not None:
+                    remaining_cooldown = self.cooldown - (
+                        time.monotonic() - self.time_of_last_rate_limit_error
+                    )
+                    if remaining_cooldown > 0:
+                        await asyncio.sleep(remaining_cooldown)
+                        continue
+
+                self._refill()
+                missing_requests = (
+                    1 - self.available_request_capacity if self.max_rpm else 0
+                )
+                missing_tokens = (
+                    tokens - self.available_token_capacity if self.max_tpm else 0
+                )
+                if missing_requests <= 0 and missing_tokens <= 0:
+                    if self.max_rpm:
+                        self.available_request_capacity -= 1
+                    if self.max_tpm:
+                        self.available_token_capacity -= tokens
+                    return
+
+                # Sleep just long enough for the buckets to cover the request
+                wait = max(
+                    missing_requests * 60.0 / self.max_rpm if self.max_rpm else 0,
+                    missing_tokens * 60.0 / self.max_tpm if self.max_tpm else 0,
+                )
+                await asyncio.sleep(wait)
+
+    def notify_rate_limit_error(self):
+        """Register a rate limit error returned by the API"""
+        self.time_of_last_rate_limit_error = time.monotonic()
+        self.available_request_capacity /= 2
+        self.available_token_capacity /= 2
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoder(model: str):
+    """Get the tiktoken encoder for a model, cached per model
+
+    Parameters
+    ----------
+    model : str
+        Model name
+
+    Returns
+    -------
+    tiktoken.Encoding or None
+        Encoder for the model, falling back to cl100k_base for unknown
+        models, or None if no encoding could be loaded
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding for model {model}: {e}")
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding cl100k_base: {e}")
+        return None
+
+
+def estimate_tokens(text: str, model: str) -> int:
+    """Estimate the number of tokens in a text
+
+    Parameters
+    ----------
+    text : str
+        Text to count tokens of
+    model : str
+        Model name used to select the tokenizer
+
+    Returns
+    -------
+    int
+        Number of tokens, or a rough estimate of 4 characters per token if
+        no tokenizer is available
+    """
+    encoder = get_token_encoder(model)
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text))
+
+
+@functools.lru_cache(maxsize=65536)
+def estimate_text_tokens(text: str, model: str) -> int:
+    """Estimate the number of tokens of a subtitle text, memoized
+
+    Retries and repeated lines do not encode the same text again.
+
+    Parameters
+    ----------
+    text : str
+        Subtitle text
+    model : str
+        Model name used to select the tokenizer
+
+    Returns
+    -------
+    int
+        Estimated number of tokens
+    """
+    return estimate_tokens(text=text, model=model)
+
+
+@functools.lru_cache(maxsize=None)
+def estimate_prompt_overhead_tokens(model: str, context: str, target_language: str):
+    """Estimate the tokens of the parts of the prompt that are not subtitle texts
+
+    Parameters
+    ----------
+    model : str
+        Model name used to select the tokenizer
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+
+    Returns
+    -------
+    tuple
+        Tokens of the fixed instructions, which only depend on the context
+        and target language, and tokens of the XML tag and timing wrapping
+        each subtitle text
+    """
+    instructions_tokens = sum(
+        estimate_tokens(text=message["content"], model=model)
+        for message in build_messages(
+            window=[], context=context, target_language=target_language
+        )
+    )
+    per_text_tokens = estimate_tokens(
+        text='<text id="10" start="00:00:00,000" end="00:00:00,000"></text>\n',
+        model=model,
+    )
+    return instructions_tokens, per_text_tokens
+
+
+def estimate_prompt_tokens(window, context, target_language, model) -> int:
+    """Estimate the number of tokens of the prompt of a window
+
+    Only the subtitle texts are encoded, the instructions and the XML
+    wrapping are counted once per run.
+
+    Parameters
+    ----------
+    window : list
+        List of subtitle entries to translate
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    model : str
+        Model name used to select the tokenizer
+
+    Returns
+    -------
+    int
+        Estimated number of tokens of build_messages's output
+    """
+    instructions_tokens, per_text_tokens = estimate_prompt_overhead_tokens(
+        model=model, context=context, target_language=target_language
+    )
+    return (
+        instructions_tokens
+        + len(window) * per_text_tokens
+        + sum(estimate_text_tokens(text=sub.text, model=model) for sub in window)
+    )
+
+
+class OrderedSrtWriter:
+    """Append translated windows to an SRT file, in window order
+
+    Each subtitle entry is written once, as soon as its window and all the
+    windows before it are translated, instead of re-serializing the whole
+    file after every window. Windows completing out of order, as they do
+    with concurrent requests, are buffered until the gap before them is
+    filled.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the SRT file to write
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8", buffering=1 << 16)
+        self.pending_windows = {}
+        self.next_window_idx = 0
+
+    def add(self, window_idx: int, translated_window: list):
+        """Write a translated window, or buffer it until its turn comes
+
+        Parameters
+        ----------
+        window_idx : int
+            Position of the window in the input, starting at 0
+        translated_window : list
+            Translated subtitle entries of the window
+        """
+        self.pending_windows[window_idx] = translated_window
+        if self.next_window_idx not in self.pending_windows:
+            return
+        while self.next_window_idx in self.pending_windows:
+            # Same serialization as pysrt's SubRipFile.save, one write per
+            # window: the blank line after an entry is only added when its
+            # text does not already end with one, e.g. when the text is empty
+            self.file.writelines(
+                [
+                    text if text.endswith("\n\n") else text + "\n"
+                    for text in map(str, self.pending_windows.pop(self.next_window_idx))
+                ]
+            )
+            self.next_window_idx += 1
+        # Flush so that the temporary file can be used to recover on failure
+        self.file.flush()
+
+    def close(self):
+        """Close the file"""
+        self.file.close()
+
+
+class TranslationCache:
+    """SQLite cache of subtitle translations, shared across runs
+
+    Translations are keyed by a hash of the model, context, target language
+    and original text, so that re-running a file, or a line repeated in a
+    series, costs a lookup instead of an API request.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path of the SQLite database, created if needed, or ":memory:" for a
+        cache only living as long as the run
+    """
+
+    def __init__(self, path):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        # WAL lets several runs share the cache and makes commits cheap
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, translation TEXT)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str, context: str, target_language: str) -> str:
+        """Hash everything the translation of a text depends on"""
+        return hashlib.sha256(
+            "\0".join([model, context or "", target_language, text]).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, texts, model: str, context: str, target_language: str) -> dict:
+        """Look up the cached translations of texts
+
+        Parameters
+        ----------
+        texts : iterable
+            Original subtitle texts
+        model : str
+            Model name used for translation
+        context : str
+            Context information for translation
+        target_language : str
+            Target language for translation
+
+        Returns
+        -------
+        dict
+            Translation of each text found in the cache, by original text
+        """
+        translations = {}
+        for text in texts:
+            row = self.connection.execute(
+                "SELECT translation FROM cache WHERE key = ?",
+                (
+                    self.make_key(
+                        text=text,
+                        model=model,
+                        context=context,
+                        target_language=target_language,
+                    ),
+                ),
+            ).fetchone()
+            if row is not None:
+                translations[text] = row[0]
+        return translations
+
+    def put(self, translations: dict, model: str, context: str, target_language: str):
+        """Store translations in a single transaction
+
+        Parameters
+        ----------
+        translations : dict
+            Translated text by original text
+        model : str
+            Model name used for translation
+        context : str
+            Context information for translation
+        target_language : str
+            Target language for translation
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, translation) VALUES (?, ?)",
+                [
+                    (
+                        self.make_key(
+                            text=text,
+                            model=model,
+                            context=context,
+                            target_language=target_language,
+                        ),
+                        translation,
+                    )
+                    for text, translation in translations.items()
+                ],
+            )
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+
+def open_srt_file(path: str):
+    """Open an SRT file for streaming, detecting its encoding like pysrt.open
+
+    Parameters
+    ----------
+    path : str
+        Path to the SRT file
+
+    Returns
+    -------
+    file
+        Text file object positioned after the BOM, if any
+    """
+    # Reuse pysrt's own BOM based encoding detection so that streaming
+    # decodes files exactly like pysrt.open would
+    srt_file, _ = pysrt.SubRipFile._open_unicode_file(path)
+    return srt_file
+
+
+def stream_srt_file(path: str):
+    """Parse the subtitle entries of an SRT file lazily
+
+    Parameters
+    ----------
+    path : str
+        Path to the SRT file
+
+    Yields
+    ------
+    pysrt.SubRipItem
+        Subtitle entries, as soon as they are parsed
+    """
+    with open_srt_file(path=path) as srt_file:
+        yield from pysrt.stream(srt_file)
+
+
+def count_subtitles(path: str) -> int:
+    """Count the subtitle entries of an SRT file without parsing them
+
+    Parameters
+    ----------
+    path : str
+        Path to the SRT file
+
+    Returns
+    -------
+    int
+        Number of timing lines in the file
+    """
+    with open_srt_file(path=path) as srt_file:
+        return sum(1 for line in srt_file if "-->" in line)
+
+
+def iter_windows(subs, window_size: int):
+    """Group subtitle entries into windows as they are produced
+
+    Parameters
+    ----------
+    subs : iterable
+        Iterable of subtitle entries, e.g. pysrt.stream(...)
+    window_size : int
+        Number of subtitle entries per window
+
+    Yields
+    ------
+    list
+        Window of at most window_size subtitle entries
+    """
+    window = []
+    for sub in subs:
+        window.append(sub)
+        if len(window) == window_size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+async def translate_windows(
+    client,
+    windows,
+    writer,
+    total_windows,
+    windows_per_request,
+    model,
+    context,
+    target_language,
+    max_concurrency,
+    max_rpm=None,
+    max_tpm=None,
+    max_chars_per_request=None,
+    cache=None,
+    stream=False,
+    max_tokens=None,
+):
+    """Translate all windows concurrently, preserving their order
+
+    The workload is purely I/O bound so the windows are sent to the API
+    concurrently by max_concurrency workers, windows_per_request windows
+    at a time. Windows are pulled from the iterable through a bounded queue,
+    so that translation starts before the input is fully parsed and only a
+    few windows are held in memory ahead of the workers. Reading also pauses
+    while a slow window keeps the writer from writing the windows after it.
+
+    Parameters
+    ----------
+    client : AsyncOpenAI or AiohttpChatClient
+        Client returned by get_client
+    windows : iterable
+        Iterable of windows, each being a list of subtitle entries
+    writer : OrderedSrtWriter
+        Writer receiving each translated window as soon as it is done
+    total_windows : int or None
+        Number of windows, only used for the progress bar
+    windows_per_request : int or None
+        Maximum number of consecutive windows merged into a single API
+        request, None to only be limited by max_chars_per_request
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    max_concurrency : int
+        Maximum number of windows being translated at the same time
+    max_rpm : float or None
+        Maximum number of requests per minute, None for no limit
+    max_tpm : float or None
+        Maximum number of tokens per minute, None for no limit
+    max_chars_per_request : int or None
+        Maximum number of subtitle characters merged into a single API
+        request, a window larger than that is still sent on its own. None
+        for no limit, in which case windows_per_request must be set.
+    cache : TranslationCache or None
+        Cache of translations to look up before, and fill after, each
+        request
+    stream : bool
+        If True, stream the answers and stop reading them at </answer>
+    max_tokens : int or None
+        Maximum number of tokens of each answer, None for the API default
+    """
+    rate_limiter = (
+        RateLimiter(max_rpm=max_rpm, max_tpm=max_tpm) if max_rpm or max_tpm else None
+    )
+    window_queue = asyncio.Queue(maxsize=max_concurrency * 2)
+    progress = tqdm(total=total_windows, desc="Translating")
+    window_written = asyncio.Event()
+    # Texts being translated by a request, so that the repeated ones (e.g. a
+    # chorus) in the other requests in flight wait for it instead of being
+    # sent again
+    in_flight = {}
+
+    async def produce():
+        # Parsing the next window can block, e.g. while ffmpeg reads the
+        # video, so it happens in a thread to keep the requests flowing
+        loop = asyncio.get_running_loop()
+        window_iterator = iter(windows)
+        group = []
+        group_chars = 0
+        window_idx = 0
+        # Windows finished out of order wait in the writer, this bounds how
+        # many. Requests packed by characters only can hold any number of
+        # windows, so the bound follows the largest request sent so far
+        largest_group = windows_per_request or 1
+        while True:
+            # While a window is being retried, the ones after it cannot be
+            # written, so stop reading ahead until it is done
+            while (
+                window_idx - len(group) - writer.next_window_idx
+                >= 4 * max_concurrency * largest_group
+            ):
+                window_written.clear()
+                await window_written.wait()
+            next_window = loop.run_in_executor(None, next, window_iterator, None)
+            try:
+                window = await asyncio.shield(next_window)
+            except asyncio.CancelledError:
+                # The thread cannot be interrupted, wait for it to leave the
+                # generator so that the caller can close it once we return
+                await asyncio.wait([next_window])
+                raise
+            if window is None:
+                break
+            if max_chars_per_request:
+                # Greedily pack windows until the character budget is reached
+                window_chars = sum(len(sub.text) for sub in window)
+                if group and group_chars + window_chars > max_chars_per_request:
+                    largest_group = max(largest_group, len(group))
+                    await window_queue.put(group)
+                    group = []
+                    group_chars = 0
+                group_chars += window_chars
+            group.append((window_idx, window))
+            window_idx += 1
+            if len(group) == windows_per_request:
+                largest_group = max(largest_group, len(group))
+                await window_queue.put(group)
+                group = []
+                group_chars = 0
+        if group:
+            await window_queue.put(group)
+        # One sentinel per worker to signal the end of the input
+        for _ in range(max_concurrency):
+            await window_queue.put(None)
+
+    async def work():
+        while True:
+            group = await window_queue.get()
+            if group is None:
+                return
+            translated_windows = await translate_request(
+                client=client,
+                windows=[window for _, window in group],
+                model=model,
+                context=context,
+                target_language=target_language,
+                rate_limiter=rate_limiter,
+                cache=cache,
+                stream=stream,
+                max_tokens=max_tokens,
+                in_flight=in_flight,
+            )
+            for (window_idx, _), translated_window in zip(group, translated_windows):
+                writer.add(window_idx=window_idx, translated_window=translated_window)
+            window_written.set()
+            progress.update(len(group))
+
+    tasks = [asyncio.ensure_future(produce())] + [
+        asyncio.ensure_future(work()) for _ in range(max_concurrency)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # If a worker crashed, stop the others instead of leaving them running,
+        # and wait for them to stop, as the producer may be reading a window
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        progress.close()
+
+
+async def translate_windows_batch(
+    client,
+    windows,
+    writer,
+    model,
+    context,
+    target_language,
+    max_poll_interval=600.0,
+    cache=None,
+    max_tokens=None,
+):
+    """Translate all windows through the OpenAI Batch API
+
+    Every window becomes one request of a JSONL file that is uploaded and
+    submitted as a batch, which costs half the price of synchronous requests
+    and has its own, higher, rate limits. The batch is then polled with an
+    exponentially growing interval until it finishes, which can take up to
+    24 hours.
+
+    Parameters
+    ----------
+    client : AsyncOpenAI
+        AsyncOpenAI client instance
+    windows : iterable
+        Iterable of windows, each being a list of subtitle entries
+    writer : OrderedSrtWriter
+        Writer receiving the translated windows. Windows whose answer is
+        missing or could not be parsed are translated again with a regular
+        request.
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    max_poll_interval : float
+        Maximum number of seconds between two status checks
+    cache : TranslationCache or None
+        Cache of translations to look up before, and fill after, the batch
+    max_tokens : int or None
+        Maximum number of tokens of each answer, None for the API default
+    """
+    windows = list(windows)
+
+    # Entries without words or already cached are not part of the batch
+    prepared_windows = [
+        prepare_window(
+            window=window,
+            model=model,
+            context=context,
+            target_language=target_language,
+            cache=cache,
+        )
+        for window in windows
+    ]
+    # A text repeated in several windows, e.g. a chorus, is only sent with
+    # the first of them
+    sent_texts = set()
+    batch_windows = []
+    for _, to_translate, _ in prepared_windows:
+        to_send = [sub for sub in to_translate if sub.text not in sent_texts]
+        sent_texts.update(sub.text for sub in to_send)
+        batch_windows.append(to_send)
+
+    answers = {}
+    batch_input_file = tempfile.NamedTemporaryFile(
+        mode="w", suffix=".jsonl", encoding="utf-8", delete=False
+    )
+    batch_input_path = batch_input_file.name
+    try:
+        n_requests = 0
+        with batch_input_file:
+            for window_idx, to_translate in enumerate(batch_windows):
+                if not to_translate:
+                    continue
+                request = {
+                    "custom_id": f"win-{window_idx}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "messages": build_messages(
+                            window=to_translate,
+                            context=context,
+                            target_language=target_language,
+                        ),
+                        "temperature": 0.3,
+                    },
+                }
+                if max_tokens:
+                    request["body"]["max_tokens"] = max_tokens
+                batch_input_file.write(json.dumps(request) + "\n")
+                n_requests += 1
+
+        # An empty batch would be rejected
+        if n_requests:
+
+            async def upload():
+                # Reopened on each attempt to send the file from its start
+                with open(batch_input_path, "rb") as f:
+                    return await client.files.create(file=f, purpose="batch")
+
+            uploaded_file = await call_with_backoff(request=upload)
+    finally:
+        Path(batch_input_path).unlink(missing_ok=True)
+
+    if n_requests:
+        answers = await run_batch(
+            client=client,
+            input_file_id=uploaded_file.id,
+            n_requests=n_requests,
+            max_poll_interval=max_poll_interval,
+        )
+
+    # Translations of the texts sent, whichever window they were sent with
+    batch_translations = {}
+    for window_idx, to_translate in enumerate(batch_windows):
+        if not to_translate:
+            continue
+        custom_id = f"win-{window_idx}"
+        try:
+            if custom_id not in answers:
+                raise ValueError("No successful response in the batch output")
+            translated_texts = parse_xml_response(answers[custom_id], len(to_translate))
+        except ValueError as e:
+            # Failed windows are few, a regular request is quicker than
+            # submitting another batch
+            logger.warning(
+                f"Failed to translate window {window_idx} in batch, retrying it with a regular request: {e}"
+            )
+            new_translations = await request_translations(
+                client=client,
+                subs=to_translate,
+                model=model,
+                context=context,
+                target_language=target_language,
+                cache=cache,
+                max_tokens=max_tokens,
+            )
+        else:
+            new_translations = dict(
+                zip([sub.text for sub in to_translate], translated_texts)
+            )
+            if cache is not None:
+                cache.put(
+                    translations=new_translations,
+                    model=model,
+                    context=context,
+                    target_language=target_language,
+                )
+        batch_translations.update(new_translations)
+
+    for window_idx, (window, (translatable, _, translations)) in enumerate(
+        zip(windows, prepared_windows)
+    ):
+        # Texts that could not be translated are kept as is
+        translated_window = build_translated_window(
+            window=window,
+            translated_texts=[
+                translations.get(sub.text, batch_translations.get(sub.text, sub.text))
+                for sub in translatable
+            ],
+        )
+        writer.add(window_idx=window_idx, translated_window=translated_window)
+
+
+async def run_batch(client, input_file_id, n_requests, max_poll_interval):
+    """Submit an uploaded JSONL file as a batch and wait for its results
+
+    Parameters
+    ----------
+    client : AsyncOpenAI
+        AsyncOpenAI client instance
+    input_file_id : str
+        Id of the uploaded JSONL file of requests
+    n_requests : int
+        Number of requests in the file, only used for logging
+    max_poll_interval : float
+        Maximum number of seconds between two status checks
+
+    Returns
+    -------
+    dict
+        Answer of each successful request, by custom_id
+    """
+    # The SDK does not retry on its own (see get_client). Once the batch is
+    # submitted it is paid for, so a transient error or network blip while
+    # waiting for it must not end the run
+    batch = await call_with_backoff(
+        request=functools.partial(
+            client.batches.create,
+            input_file_id=input_file_id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+    )
+    logger.info(f"Submitted batch {batch.id} with {n_requests} requests")
+
+    # Poll with an exponentially growing interval as batches can take hours
+    poll_interval = 5.0
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+        batch = await call_with_backoff(
+            request=functools.partial(client.batches.retrieve, batch.id),
+            retry_connection_errors=True,
+        )
+        counts = batch.request_counts
+        logger.info(
+            f"Batch {batch.id} is {batch.status}"
+            + (f" ({counts.completed}/{counts.total} done)" if counts else "")
+        )
+
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
+    answers = {}
+    if batch.output_file_id:
+        output = await call_with_backoff(
+            request=functools.partial(client.files.content, batch.output_file_id),
+            retry_connection_errors=True,
+        )
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            try:
+                answers[result["custom_id"]] = get_answer_content(
+                    response=response.get("body")
+                )
+            except ValueError as e:
+                # Left out of the answers, the window is retried with a
+                # regular request
+                logger.warning(f"No answer for {result['custom_id']} in batch: {e}")
+    return answers
+
+
+class LocalTranslator:
+    """Translate texts locally with a CTranslate2 model, without any API
+
+    Meant for NLLB-200 models converted with ct2-transformers-converter.
+    Runs quantized to int8 on the CPU, or int8_float16 when a GPU is
+    available. ctranslate2 and transformers are imported here rather than at
+    the top of the module as transformers takes seconds to import.
+
+    Parameters
+    ----------
+    model_path : str
+        Directory of the converted model, also holding its tokenizer files
+    source_language : str
+        Language code of the texts, e.g. eng_Latn
+    target_language : str
+        Language code of the translations, e.g. fra_Latn
+    max_batch_size : int
+        Maximum number of texts translated in one batch by the model
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        source_language: str,
+        target_language: str,
+        max_batch_size: int = 64,
+    ):
+        import ctranslate2
+        import transformers
+
+        if ctranslate2.get_cuda_device_count() > 0:
+            device, compute_type = "cuda", "int8_float16"
+        else:
+            device, compute_type = "cpu", "int8"
+        self.translator = ctranslate2.Translator(
+            model_path, device=device, compute_type=compute_type
+        )
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(
+            model_path, src_lang=source_language
+        )
+        self.model_path = model_path
+        self.source_language = source_language
+        self.target_language = target_language
+        self.max_batch_size = max_batch_size
+
+    def translate(self, texts: list) -> list:
+        """Translate texts, blocking until they are all done
+
+        Parameters
+        ----------
+        texts : list
+            Texts to translate
+
+        Returns
+        -------
+        list
+            Translated texts, in the same order
+        """
+        source_tokens = [
+            self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text))
+            for text in texts
+        ]
+        results = self.translator.translate_batch(
+            source_tokens,
+            target_prefix=[[self.target_language]] * len(source_tokens),
+            beam_size=1,
+            max_batch_size=self.max_batch_size,
+        )
+        # The first token of each hypothesis is the target language code
+        return [
+            self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(result.hypotheses[0][1:]),
+                skip_special_tokens=True,
+            )
+            for result in results
+        ]
+
+
+async def translate_windows_local(
+    translator, windows, writer, total_windows, cache=None
+):
+    """Translate all windows with a local model
+
+    The model is compute bound, so instead of concurrent requests the texts
+    of consecutive windows are gathered into batches of about
+    translator.max_batch_size texts. Each batch is translated in a thread
+    to keep the event loop free.
+
+    Parameters
+    ----------
+    translator : LocalTranslator
+        Local model to translate with
+    windows : iterable
+        Iterable of windows, each being a list of subtitle entries
+    writer : OrderedSrtWriter
+        Writer receiving each translated window
+    total_windows : int or None
+        Number of windows, only used for the progress bar
+    cache : TranslationCache or None
+        Cache of translations to look up before, and fill after, each batch
+    """
+    loop = asyncio.get_running_loop()
+    progress = tqdm(total=total_windows, desc="Translating")
+    # The cache is shared with the API backend, so its keys name the model
+    model = f"ctranslate2:{translator.model_path}:{translator.source_language}"
+
+    async def translate_group(group):
+        # Texts repeated across the windows of the batch are translated once
+        texts = list(
+            dict.fromkeys(
+                sub.text for _, _, _, to_translate, _ in group for sub in to_translate
+            )
+        )
+        new_translations = {}
+        if texts:
+            translated_texts = await loop.run_in_executor(
+                None, translator.translate, texts
+            )
+            new_translations = dict(zip(texts, translated_texts))
+            if cache is not None:
+                cache.put(
+                    translations=new_translations,
+                    model=model,
+                    context="",
+                    target_language=translator.target_language,
+                )
+        for window_idx, window, translatable, _, translations in group:
+            translations.update(new_translations)
+            writer.add(
+                window_idx=window_idx,
+                translated_window=build_translated_window(
+                    window=window,
+                    translated_texts=[translations[sub.text] for sub in translatable],
+                ),
+            )
+        progress.update(len(group))
+
+    try:
+        group = []
+        group_texts = 0
+        for window_idx, window in enumerate(windows):
+            translatable, to_translate, translations = prepare_window(
+                window=window,
+                model=model,
+                context="",
+                target_language=translator.target_language,
+                cache=cache,
+            )
+            group.append((window_idx, window, translatable, to_translate, translations))
+            group_texts += len(to_translate)
+            if group_texts >= translator.max_batch_size:
+                await translate_group(group=group)
+                group = []
+                group_texts = 0
+        if group:
+            await translate_group(group=group)
+    finally:
+        progress.close()
+
+
+async def translate_request(
+    client,
+    windows,
+    model,
+    context,
+    target_language,
+    rate_limiter=None,
+    cache=None,
+    stream=False,
+    max_tokens=None,
+    in_flight=None,
+):
+    """Translate several windows with a single API request
+
+    The windows are merged into one prompt, with ids continuing across
+    windows, and the answer is sliced back into windows. This amortizes the
+    instructions over more subtitles and makes fewer requests. If the merged
+    answer cannot be parsed twice in a row, each window is translated on
+    its own instead.
+
+    Parameters
+    ----------
+    client : AsyncOpenAI or AiohttpChatClient
+        Client returned by get_client
+    windows : list
+        List of windows, each being a list of subtitle entries
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    rate_limiter : RateLimiter or None
+        Throttler to wait on before each API request
+    cache : TranslationCache or None
+        Cache of translations to look up before, and fill after, each
+        request
+    stream : bool
+        If True, stream the answers and stop reading them at </answer>
+    max_tokens : int or None
+        Maximum number of tokens of each answer, None for the API default
+    in_flight : dict or None
+        Future of the translation of each text being sent by a concurrent
+        request, see translate_window
+
+    Returns
+    -------
+    list
+        List of translated windows, in the same order as windows
+    """
+    if len(windows) > 1:
+        merged_window = [sub for window in windows for sub in window]
+        try:
+            translated_subs = await translate_window(
+                client=client,
+                window=merged_window,
+                model=model,
+                context=context,
+                target_language=target_language,
+                rate_limiter=rate_limiter,
+                cache=cache,
+                stream=stream,
+                max_tokens=max_tokens,
+                in_flight=in_flight,
+                max_retries=2,
+                raise_on_failure=True,
+            )
+        except ValueError as e:
+            logger.warning(
+                f"Merged request of {len(windows)} windows failed, translating them one by one: {e}"
+            )
+        else:
+            translated_windows = []
+            start = 0
+            for window in windows:
+                translated_windows.append(translated_subs[start : start + len(window)])
+                start += len(window)
+            return translated_windows
+
+    # Windows are translated sequentially to stay within max_concurrency
+    translated_windows = []
+    for window in windows:
+        translated_windows.append(
+            await translate_window(
+                client=client,
+                window=window,
+                model=model,
+                context=context,
+                target_language=target_language,
+                rate_limiter=rate_limiter,
+                cache=cache,
+                stream=stream,
+                max_tokens=max_tokens,
+                in_flight=in_flight,
+            )
+        )
+    return translated_windows
+
+
+async def translate_window(
+    client,
+    window,
+    model,
+    context,
+    target_language,
+    rate_limiter=None,
+    cache=None,
+    stream=False,
+    max_tokens=None,
+    max_retries=3,
+    raise_on_failure=False,
+    in_flight=None,
+):
+    """Translate a window of subtitle entries using OpenAI API
+
+    Parameters
+    ----------
+    client : AsyncOpenAI or AiohttpChatClient
+        Client returned by get_client
+    window : list
+        List of subtitle entries to translate
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    rate_limiter : RateLimiter or None
+        Throttler to wait on before each API request
+    cache : TranslationCache or None
+        Cache of translations to look up before, and fill after, the
+        request. Only the texts missing from it are sent.
+    stream : bool
+        If True, stream the answer and stop reading it at </answer>
+    max_tokens : int or None
+        Maximum number of tokens of the answer, None for the API default
+    max_retries : int
+        Number of attempts at getting an answer that can be parsed before
+        giving up on the window. Transient API errors are retried on their
+        own by call_with_backoff.
+    raise_on_failure : bool
+        If True, raise a ValueError when every attempt failed instead of
+        returning the original texts
+    in_flight : dict or None
+        Future of the translation of each text currently being sent by a
+        concurrent request, shared by all the requests of the run. Texts
+        found in it are awaited instead of being sent again, and the texts
+        sent by this window are added to it until their answer arrives.
+
+    Returns
+    -------
+    list
+        Translated subtitle entries, with the original text for the entries
+        that could not be translated
+    """
+    translatable, to_translate, translations = prepare_window(
+        window=window,
+        model=model,
+        context=context,
+        target_language=target_language,
+        cache=cache,
+    )
+
+    while to_translate:
+        pending = {}
+        claimed = {}
+        if in_flight is not None:
+            loop = asyncio.get_running_loop()
+            for sub in to_translate:
+                if sub.text in in_flight:
+                    pending[sub.text] = in_flight[sub.text]
+                else:
+                    claimed[sub.text] = in_flight[sub.text] = loop.create_future()
+            to_translate = [sub for sub in to_translate if sub.text not in pending]
+
+        try:
+            if to_translate:
+                translations.update(
+                    await request_translations(
+                        client=client,
+                        subs=to_translate,
+                        model=model,
+                        context=context,
+                        target_language=target_language,
+                        rate_limiter=rate_limiter,
+                        cache=cache,
+                        stream=stream,
+                        max_tokens=max_tokens,
+                        max_retries=max_retries,
+                        raise_on_failure=raise_on_failure,
+                    )
+                )
+        finally:
+            # None tells the windows waiting on a text that it failed
+            for text, future in claimed.items():
+                del in_flight[text]
+                future.set_result(translations.get(text))
+
+        # The shield keeps a cancelled window from cancelling the future
+        # that other windows may be waiting on too
+        to_translate = []
+        for text, future in pending.items():
+            translation = await asyncio.shield(future)
+            if translation is None:
+                # The request that had it failed, send it again from here
+                to_translate.append(
+                    next(sub for sub in translatable if sub.text == text)
+                )
+            else:
+                translations[text] = translation
+
+    # Texts that could not be translated are kept as is
+    return build_translated_window(
+        window=window,
+        translated_texts=[translations.get(sub.text, sub.text) for sub in translatable],
+    )
+
+
+async def request_translations(
+    client,
+    subs,
+    model,
+    context,
+    target_language,
+    rate_limiter=None,
+    cache=None,
+    stream=False,
+    max_tokens=None,
+    max_retries=3,
+    raise_on_failure=False,
+) -> dict:
+    """Send subtitle texts to the model and read their translations
+
+    Parameters
+    ----------
+    client : AsyncOpenAI or AiohttpChatClient
+        Client returned by get_client
+    subs : list
+        Subtitle entries to translate, each text only once
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    rate_limiter : RateLimiter or None
+        Throttler to wait on before each API request
+    cache : TranslationCache or None
+        Cache in which the translations are stored
+    stream : bool
+        If True, stream the answer and stop reading it at </answer>
+    max_tokens : int or None
+        Maximum number of tokens of the answer, None for the API default
+    max_retries : int
+        Number of attempts at getting an answer that can be parsed before
+        giving up. Transient API errors are retried on their own by
+        call_with_backoff.
+    raise_on_failure : bool
+        If True, raise a ValueError when every attempt failed instead of
+        returning no translations
+
+    Returns
+    -------
+    dict
+        Translation of each text, empty if every attempt failed
+    """
+    messages = build_messages(
+        window=subs, context=context, target_language=target_language
+    )
+
+    # The answer is roughly as long as the prompt, count it twice
+    request_tokens = 0
+    if rate_limiter is not None and rate_limiter.max_tpm:
+        request_tokens = 2 * estimate_prompt_tokens(
+            window=subs,
+            context=context,
+            target_language=target_language,
+            model=model,
+        )
+
+    # Only sent when set, as not every server accepts a null max_tokens
+    options = {"max_tokens": max_tokens} if max_tokens else {}
+
+    async def send_request():
+        if rate_limiter is not None:
+            await rate_limiter.acquire(tokens=request_tokens)
+        return await create_chat_completion(
+            client,
+            model=model,
+            messages=messages,
+            temperature=0.3,
+            stream=stream,
+            **options,
+        )
+
+    for attempt in range(max_retries):
+        try:
+            response_text = await call_with_backoff(
+                request=send_request, rate_limiter=rate_limiter
+            )
+            translated_texts = parse_xml_response(response_text, len(subs))
+            new_translations = dict(zip([sub.text for sub in subs], translated_texts))
+            if cache is not None:
+                cache.put(
+                    translations=new_translations,
+                    model=model,
+                    context=context,
+                    target_language=target_language,
+                )
+            return new_translations
+
+        except (RateLimitError, APITimeoutError, InternalServerError):
+            # Transient errors were already retried and logged by call_with_backoff
+            raise
+        except APIConnectionError as e:
+            # Connection errors should crash immediately with helpful trace
+            logger.error(f"API connection error - check network and base URL: {e}")
+            raise
+        except AuthenticationError as e:
+            # Authentication errors should crash immediately
+            logger.error(f"API authentication failed - check API key: {e}")
+            raise
+        except APIStatusError as e:
+            # API status errors (like invalid model) should crash immediately
+            logger.error(f"API returned error status - check model name and API: {e}")
+            raise
+        except ValueError as e:
+            if attempt < max_retries - 1:
+                # Retry with error message for parsing errors, the model is
+                # not overloaded so a short pause is enough. Only the user
+                # message changes, keeping the cached system prefix
+                retry_note = f"\n\nPrevious parsing failed with error: {str(e)}. Please correct the format and try again."
+                messages[-1]["content"] += retry_note
+                await asyncio.sleep(0.5)
+                continue
+            elif raise_on_failure:
+                raise ValueError(
+                    f"Failed to translate window after {max_retries} attempts: {e}"
+                ) from e
+            else:
+                logger.error(
+                    f"Failed to translate window after {max_retries} attempts: {e}"
+                )
+                # The caller keeps the original texts as fallback
+                return {}
+
+
+async def call_with_backoff(
+    request, rate_limiter=None, max_retries=6, retry_connection_errors=False
+):
+    """Send an API request, retrying transient errors with backoff
+
+    Rate limits, timeouts, server errors (500, 502, 503, 504...) and errors
+    sent in the middle of a streamed answer are retried after the delay
+    given by the server's Retry-After header, or else after a capped
+    exponential backoff with jitter, so that retries do not hammer an
+    overloaded server. Other API errors are raised at once.
+
+    Parameters
+    ----------
+    request : callable
+        Coroutine function sending the request, called again on each attempt
+    rate_limiter : RateLimiter or None
+        Throttler to notify when the API reports a rate limit
+    max_retries : int
+        Number of attempts before raising the last transient error
+    retry_connection_errors : bool
+        If True, connection errors are retried too instead of being raised
+        at once, for requests about work that is already paid for
+
+    Returns
+    -------
+    object
+        Result of the first successful request
+    """
+    transient_errors = (RateLimitError, APITimeoutError, InternalServerError)
+    if retry_connection_errors:
+        transient_errors += (APIConnectionError,)
+    for attempt in range(max_retries):
+        try:
+            return await request()
+        except APIError as e:
+            # The SDK raises a plain APIError for an error event in the middle
+            # of a streamed answer, e.g. when the model is overloaded
+            if not isinstance(e, transient_errors) and type(e) is not APIError:
+                raise
+            if isinstance(e, RateLimitError) and rate_limiter is not None:
+                rate_limiter.notify_rate_limit_error()
+            if attempt == max_retries - 1:
+                logger.error(f"API still failing after {max_retries} attempts: {e}")
+                raise
+            delay = retry_after_delay(error=e)
+            if delay is None:
+                delay = backoff_delay(attempt=attempt)
+            logger.warning(f"Transient API error, retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+
+def retry_after_delay(error, max_delay: float = 60.0):
+    """Read the delay the server asked to wait before retrying
+
+    Parameters
+    ----------
+    error : openai.APIError
+        Error raised by the request
+    max_delay : float
+        Longer delays are ignored, as the server's estimate is then unlikely
+        to be better than the backoff
+
+    Returns
+    -------
+    float or None
+        Delay in seconds from the retry-after-ms or Retry-After headers,
+        None if there is none or it is unusable
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    delay = None
+    try:
+        if "retry-after-ms" in headers:
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif "retry-after" in headers:
+            retry_after = headers["retry-after"]
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # The header can also be an HTTP date
+                delay = (
+                    parsedate_to_datetime(retry_after)
+                    - datetime.datetime.now(datetime.timezone.utc)
+                ).total_seconds()
+    except (TypeError, ValueError):
+        return None
+    if delay is None or not 0 <= delay <= max_delay:
+        return None
+    return delay
+
+
+def backoff_delay(attempt: int, base: float = 1.0, max_delay: float = 60.0) -> float:
+    """Compute the delay before retrying a request that hit a transient error
+
+    Parameters
+    ----------
+    attempt : int
+        Number of the failed attempt, starting at 0
+    base : float
+        Delay in seconds after the first failed attempt
+    max_delay : float
+        Maximum delay in seconds, before jitter
+
+    Returns
+    -------
+    float
+        Capped exponential delay, randomized by +/-50% so that concurrent
+        requests do not all retry at the same time
+    """
+    return min(max_delay, base * 2**attempt) * random.uniform(0.5, 1.5)
+
+
+def build_messages(window, context, target_language) -> list:
+    """Build the chat messages asking to translate a window of subtitle entries
+
+    The instructions only depend on the target language and go in the system
+    message, so that providers with prompt caching can reuse them across
+    requests. The user message holds the context and the subtitles.
+
+    Parameters
+    ----------
+    window : list
+        List of subtitle entries to translate
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+
+    Returns
+    -------
+    list
+        System and user messages asking for the translations in an <answer>
+        block
+    """
+    # Build XML prompt with timing information
+    # Including timing helps the LLM understand temporal context (e.g., rapid dialogue vs. long pauses)
+    # Texts are escaped so that tags like <i> or a "&" do not break the XML
+    xml_texts = "\n".join(
+        [
+            _TEXT_TEMPLATE % (i, sub.start, sub.end, escape(sub.text))
+            for i, sub in enumerate(window, start=1)
+        ]
+    )
+
+    system_prompt, user_prefix = build_prompt_parts(
+        context=context, target_language=target_language
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prefix + xml_texts},
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def build_prompt_parts(context, target_language) -> tuple:
+    """Build the parts of the messages that are the same for every window
+
+    They only depend on the run's context and target language, so they are
+    built once and reused by every request.
+
+    Parameters
+    ----------
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+
+    Returns
+    -------
+    tuple
+        System prompt, and start of the user message preceding the
+        subtitle texts
+    """
+    context_xml = (
+        f"<srt-context>{context}</srt-context>"
+        if context
+        else "<srt-context></srt-context>"
+    )
+    return _SYSTEM_PROMPT_TEMPLATE % target_language, f"{context_xml}\n\n"
+
+
+def prepare_window(window, model, context, target_language, cache=None) -> tuple:
+    """Find the entries of a window that have to be sent to the model
+
+    Entries without words (e.g. "...", "<i></i>") are copied verbatim, and
+    entries already in the cache reuse their cached translation.
+
+    Parameters
+    ----------
+    window : list
+        List of subtitle entries
+    model : str
+        Model name to use for translation
+    context : str
+        Context information for translation
+    target_language : str
+        Target language for translation
+    cache : TranslationCache or None
+        Cache of translations
+
+    Returns
+    -------
+    tuple
+        The entries that need translation, those of them missing from the
+        cache with each text only once, and a dict of the cached
+        translations by original text
+    """
+    translatable = [sub for sub in window if needs_translation(text=sub.text)]
+    translations = {}
+    if cache is not None and translatable:
+        translations = cache.get(
+            texts=[sub.text for sub in translatable],
+            model=model,
+            context=context,
+            target_language=target_language,
+        )
+    # Repeated texts, e.g. a chorus, are only sent once
+    to_translate = []
+    seen_texts = set(translations)
+    for sub in translatable:
+        if sub.text not in seen_texts:
+            seen_texts.add(sub.text)
+            to_translate.append(sub)
+    return translatable, to_translate, translations
+
+
+def needs_translation(text: str) -> bool:
+    """Tell whether a subtitle text contains words to translate
+
+    Texts made only of numbers, punctuation, symbols or formatting tags
+    are kept as is, as are sound cues in brackets like [Music]. Lyrics
+    between music notes are still translated.
+
+    Parameters
+    ----------
+    text : str
+        Text of a subtitle entry
+
+    Returns
+    -------
+    bool
+        True if the text, without its tags, includes a letter, has at least
+        2 characters unless it is written in a CJK script, and is not a
+        sound cue
+    """
+    stripped = _TAG_RE.sub("", text).strip()
+    return (
+        (len(stripped) >= 2 or _CJK_RE.search(stripped) is not None)
+        and _LETTER_RE.search(stripped) is not None
+        and _SOUND_CUE_RE.match(stripped) is None
+    )
+
+
+def build_translated_window(window, translated_texts) -> list:
+    """Create the translated subtitle entries of a window
+
+    Parameters
+    ----------
+    window : list
+        List of original subtitle entries
+    translated_texts : list
+        Translated text of each entry that needs translation, in the same
+        order. The other entries are kept as is.
+
+    Returns
+    -------
+    list
+        List of new subtitle entries with the original index, timing and
+        position
+    """
+    translated_texts = iter(translated_texts)
+    translated_window = []
+    for original_sub in window:
+        if needs_translation(text=original_sub.text):
+            # A shallow copy keeps the index, timing and position without
+            # going through the SubRipItem constructor. The SubRipTime
+            # objects are shared with the original entry, which is fine
+            # as they are never shifted.
+            new_sub = copy.copy(original_sub)
+            new_sub.text = next(translated_texts)
+            translated_window.append(new_sub)
+        else:
+            translated_window.append(original_sub)
+    return translated_window
+
+
+def list_subtitle_streams(video_path: str) -> list:
+    """List all subtitle streams in the video file
+
+    Parameters
+    ----------
+    video_path : str
+        Path to the video file
+
+    Returns
+    -------
+    list
+        List of subtitle stream information dictionaries
+    """
+    try:
+        probe = ffmpeg.probe(filename=video_path)
+        subtitle_streams = [
+            stream for stream in probe["streams"] if stream["codec_type"] == "subtitle"
+        ]
+        return subtitle_streams
+    except ffmpeg.Error as e:
+        logger.error(f"ffmpeg error while probing video: {e.stderr.decode()}")
+        raise
+    except Exception as e:
+        logger.error(f"Error probing video file: {e}")
+        raise
+
+
+def get_subtitle_preview(
+    video_path: str, stream_index: int, max_entries: int = 200
+) -> str:
+    """Get a preview text from a subtitle stream
+
+    Extracts the first text that appears after the 5th text containing at least 10 characters.
+    This helps identify subtitle streams when metadata is unclear.
+
+    Parameters
+    ----------
+    video_path : str
+        Path to the video file
+    stream_index : int
+        Index of the subtitle stream
+    max_entries : int
+        Maximum number of entries read before giving up on finding a preview,
+        so that streams of short or repeated texts are not read to the end
+
+    Returns
+    -------
+    str
+        Preview text, or empty string if extraction fails or not enough content
+    """
+    # The subtitles are streamed from ffmpeg so that it can be stopped as
+    # soon as the preview is found instead of reading the whole video
+    subs = stream_video_subtitles(video_path=video_path, stream_index=stream_index)
+    limited_subs = itertools.islice(subs, max_entries)
+    try:
+        # Single pass over the stream: first count the texts with at least
+        # 10 characters, then, after the 5th one, return the first text that
+        # was not seen before
+        # Track all seen texts to ensure preview is unique
+        counting = True
         count = 0
-        target_index = None
         seen_texts = set()
+        seen_texts_add = seen_texts.add
 
-        for idx, sub in enumerate(subs):
+        for sub in limited_subs:
             text = sub.text.strip()
-            seen_texts.add(text)
-            if len(text) >= 10:
-                count += 1
-                if count == 5:
-                    # Now find the first unique text after this one
-                    target_index = idx + 1
-                    break
-
-        # Get the first unique text after the 5th qualifying text
-        if target_index is not None:
-            for idx in range(target_index, len(subs)):
-                preview_text = subs[idx].text.strip()
-                # Skip if we've seen this text before
-                if preview_text not in seen_texts:
-                    # Limit preview length to avoid clutter
-                    if len(preview_text) > 80:
-                        preview_text = preview_text[:77] + "..."
-                    return preview_text
-                # Add to seen_texts to track duplicates
-                seen_texts.add(preview_text)
+            if counting:
+                seen_texts_add(text)
+                if len(text) >= 10:
+                    count += 1
+                    if count == 5:
+                        counting = False
+            elif text not in seen_texts:
+                # Limit preview length to avoid clutter
+                if len(text) > 80:
+                    text = text[:77] + "..."
+                return text
 
         return ""
 
@@ -460,13 +2642,17 @@ def get_subtitle_preview(video_path: str, stream_index: int) -> str:
         logger.debug(f"Could not extract preview for stream {stream_index}: {e}")
         return ""
     finally:
-        # Clean up temp file
-        if temp_preview_file:
-            Path(temp_preview_path).unlink(missing_ok=True)
+        # Stop ffmpeg, the rest of the stream is not needed
+        subs.close()
 
 
-def extract_subtitle_stream(video_path: str, stream_index: int, output_path: str):
-    """Extract a subtitle stream from video to SRT file
+def stream_video_subtitles(video_path: str, stream_index: int):
+    """Parse the entries of a subtitle stream lazily, as ffmpeg extracts them
+
+    ffmpeg converts the stream to SRT on its standard output, which is
+    parsed directly instead of going through a temporary file. Closing the
+    generator before the end kills ffmpeg so that the rest of the video is
+    not read.
 
     Parameters
     ----------
@@ -474,52 +2660,145 @@ def extract_subtitle_stream(video_path: str, stream_index: int, output_path: str
         Path to the video file
     stream_index : int
         Index of the subtitle stream to extract
-    output_path : str
-        Path for the output SRT file
+
+    Yields
+    ------
+    pysrt.SubRipItem
+        Subtitle entries, as soon as ffmpeg outputs them
+
+    Raises
+    ------
+    ffmpeg.Error
+        If ffmpeg exits with a non zero return code
+    """
+    args = (
+        ffmpeg.input(filename=video_path)
+        .output("pipe:1", map=f"0:{stream_index}", format="srt")
+        .global_args("-loglevel", "error")
+        .compile()
+    )
+    # A 1 MiB buffer avoids many small reads on the pipe. stderr goes to a
+    # file: even with -loglevel error a damaged video can print more than a
+    # pipe holds, and ffmpeg would then block while stdout is being read
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=stderr_file, bufsize=1024 * 1024
+        )
+        finished = False
+        try:
+            yield from pysrt.stream(io.TextIOWrapper(process.stdout, encoding="utf-8"))
+            finished = True
+        finally:
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+
+    if process.returncode != 0:
+        logger.error(f"ffmpeg error while extracting subtitle: {stderr.decode()}")
+        raise ffmpeg.Error("ffmpeg", b"", stderr)
+
+
+def parse_answer_texts(answer_content) -> list:
+    """Extract the text elements of an <answer> block
+
+    The content is parsed as XML, keeping inline markup such as <i> in the
+    texts. Malformed XML (e.g. an unescaped "&") falls back to a regex,
+    which keeps the texts intact, unless lxml's recovering parser finds
+    more text elements, e.g. when the tags themselves are damaged.
+
+    Parameters
+    ----------
+    answer_content : str
+        Content between the <answer> and </answer> tags
+
+    Returns
+    -------
+    list
+        (id, text) tuples in the order they appear, with integer ids and
+        stripped texts
     """
+    xml_content = f"<root>{answer_content}</root>".encode()
     try:
-        # Use ffmpeg to extract the subtitle stream
-        # Map the specific subtitle stream and convert to SRT format
-        (
-            ffmpeg.input(filename=video_path)
-            .output(filename=output_path, map=f"0:{stream_index}", format="srt")
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
+        root = etree.fromstring(xml_content)
+    except etree.ParseError as e:
+        texts = [
+            (int(match.group(1)), unescape(match.group(2), _ENTITIES).strip())
+            for match in _TEXT_RE.finditer(answer_content)
+        ]
+        if _RECOVERING_PARSER is not None:
+            root = etree.fromstring(xml_content, _RECOVERING_PARSER)
+            if root is not None and len(root.findall("text")) > len(texts):
+                logger.warning(f"Malformed XML in answer, recovering it: {e}")
+                return xml_answer_texts(root=root)
+        logger.warning(f"Malformed XML in answer, falling back to regex: {e}")
+        return texts
+
+    return xml_answer_texts(root=root)
+
+
+def xml_answer_texts(root) -> list:
+    """Read the text elements of a parsed <answer> block
+
+    Parameters
+    ----------
+    root : Element
+        Element containing the text elements
+
+    Returns
+    -------
+    list
+        (id, text) tuples in document order, with integer ids and stripped
+        texts
+    """
+    texts = []
+    for element in root.findall("text"):
+        text_id = element.get("id")
+        if text_id is None or not text_id.isdigit():
+            raise ValueError(f"Invalid text ID {text_id!r}")
+        # Inline markup such as <i> is part of the text, in case the model
+        # did not keep it escaped
+        text = (element.text or "") + "".join(
+            unescape(etree.tostring(child, encoding="unicode"), _ENTITIES)
+            for child in element
         )
-    except ffmpeg.Error as e:
-        logger.error(f"ffmpeg error while extracting subtitle: {e.stderr.decode()}")
-        raise
-    except Exception as e:
-        logger.error(f"Error extracting subtitle stream: {e}")
-        raise
+        texts.append((int(text_id), text.strip()))
+    return texts
 
 
 def parse_xml_response(response_text, expected_count):
     """Parse XML response and extract translated texts"""
     try:
         # Extract answer block
-        answer_match = re.search(
-            pattern=r"<answer>(.*?)</answer>", string=response_text, flags=re.DOTALL
-        )
-        if not answer_match:
+        start = response_text.find("<answer>")
+        end = response_text.find("</answer>", start)
+        if start == -1 or end == -1:
             raise ValueError("No <answer> block found in response")
 
-        answer_content = answer_match.group(1)
+        answer_content = response_text[start + len("<answer>") : end]
 
         # Parse individual text elements
-        text_pattern = r'<text id="(\d+)">(.*?)</text>'
-        matches = re.findall(
-            pattern=text_pattern, string=answer_content, flags=re.DOTALL
-        )
+        matches = parse_answer_texts(answer_content)
 
         if len(matches) != expected_count:
             raise ValueError(
                 f"Expected {expected_count} text elements, found {len(matches)}"
             )
 
-        # Sort by ID and extract texts
-        matches.sort(key=lambda x: int(x[0]))
-        translated_texts = [match[1].strip() for match in matches]
+        # Place texts by ID, which go from 1 to expected_count
+        translated_texts = [None] * expected_count
+        for text_id, text in matches:
+            i = text_id - 1
+            if not 0 <= i < expected_count:
+                raise ValueError(f"Unexpected text ID {text_id}")
+            if translated_texts[i] is not None:
+                raise ValueError(f"Duplicate text ID {text_id}")
+            translated_texts[i] = text
+        # Cannot happen once count and uniqueness are checked, kept as a guard
+        if None in translated_texts:
+            raise ValueError("Text IDs do not cover every subtitle")
 
         return translated_texts
 